@@ -15,18 +15,142 @@
 # limitations under the License.
 """Verify that one set of hidden API flags is a subset of another."""
 import dataclasses
+import functools
+import sys
 import typing
 
 from itertools import chain
 
+# The tags that identify the type of each element into which a signature is
+# split by _signature_to_elements(). The tag is the first item of each element
+# tuple and is also used as the type of the corresponding Node.
+TAG_PACKAGE = "package"
+TAG_CLASS = "class"
+TAG_MEMBER = "member"
+TAG_WILDCARD = "wildcard"
 
-@dataclasses.dataclass()
+# The maximum number of package wildcard query results cached on each node.
+_MAX_CACHED_QUERIES = 16
+
+
+# pylint: disable=line-too-long
+def _signature_to_elements(signature):
+    """Split a signature or a prefix into a tuple of elements:
+
+    1. The packages (excluding the leading L preceding the first package).
+    2. The class names, from outermost to innermost.
+    3. The member signature.
+    e.g.
+    Ljava/lang/Character$UnicodeScript;->of(I)Ljava/lang/Character$UnicodeScript;
+    will be broken down into these elements:
+    1. package:java
+    2. package:lang
+    3. class:Character
+    4. class:UnicodeScript
+    5. member:of(I)Ljava/lang/Character$UnicodeScript;
+    """
+    # The elements are emitted as the signature is scanned from left to right
+    # using str.find(), rather than splitting it into intermediate lists.
+    #
+    # If a wildcard is provided then the result looks something like this:
+    #  0 - package:java
+    #  1 - package:lang
+    #  2 - wildcard:*
+    #
+    # Otherwise, it looks something like this:
+    #  0 - package:java
+    #  1 - package:lang
+    #  2 - class:Character
+    #  3 - class:UnicodeScript
+    #  4 - member:of(I)Ljava/lang/Character$UnicodeScript;
+    result = []
+
+    # Skip the leading L.
+    #  - java/lang/Character$UnicodeScript;->of(I)Ljava/lang/Character$UnicodeScript;
+    start = 1 if signature.startswith("L") else 0
+
+    # Find the separator between the qualified class name and the class member
+    # signature, if any.
+    #  java/lang/Character$UnicodeScript
+    #  of(I)Ljava/lang/Character$UnicodeScript;
+    arrow = signature.find(";->", start)
+
+    # Package wildcards, e.g. java/lang/*, have no classes or member so split
+    # out the packages directly rather than scanning for them.
+    if arrow == -1 and signature.endswith("*"):
+        package_text, separator, last_element = \
+            signature[start:].rpartition("/")
+        if last_element not in ("*", "**"):
+            raise Exception(f"Invalid signature '{signature}': invalid "
+                            f"wildcard '{last_element}'")
+        # Only a pattern without a / has no packages, e.g. "/*" has a single
+        # empty package.
+        if separator:
+            result = [(TAG_PACKAGE, sys.intern(p))
+                      for p in package_text.split("/")]
+        result.append((TAG_WILDCARD, last_element))
+        return tuple(result)
+
+    class_end = arrow if arrow != -1 else len(signature)
+
+    # Emit the packages, i.e. everything up to the last / in the qualified
+    # class name.
+    #  java
+    #  lang
+    #
+    # Intern the package and class names as they are shared by many signatures.
+    # That allows the dict lookups in the trie to compare them by identity and
+    # reuse their cached hashes.
+    while (slash := signature.find("/", start, class_end)) != -1:
+        result.append((TAG_PACKAGE, sys.intern(signature[start:slash])))
+        start = slash + 1
+
+    last_element = signature[start:class_end]
+    if "*" in last_element:
+        if last_element not in ("*", "**"):
+            raise Exception(f"Invalid signature '{signature}': invalid "
+                            f"wildcard '{last_element}'")
+        # Cannot specify a wildcard and target a specific member
+        if arrow != -1:
+            raise Exception(f"Invalid signature '{signature}': contains "
+                            f"wildcard '{last_element}' and "
+                            f"member signature '{signature[arrow + 3:]}'")
+        result.append((TAG_WILDCARD, last_element))
+        return tuple(result)
+
+    # Emit the outer / inner classes, ignoring any trailing ;.
+    #  Character
+    #  UnicodeScript
+    if last_element.endswith(";"):
+        class_end -= 1
+    while (dollar := signature.find("$", start, class_end)) != -1:
+        result.append((TAG_CLASS, sys.intern(signature[start:dollar])))
+        start = dollar + 1
+    result.append((TAG_CLASS, sys.intern(signature[start:class_end])))
+
+    # Emit the member signature, if any.
+    if arrow != -1:
+        result.append((TAG_MEMBER, signature[arrow + 3:]))
+    return tuple(result)
+
+
+# pylint: enable=line-too-long
+
+# The same class and package wildcard patterns are often passed repeatedly to
+# get_matching_rows() so cache the elements into which they are split. Member
+# signatures, whether passed to add() or get_matching_rows(), are unique so
+# they are split without the cache as it would never hit and would just keep
+# the elements alive.
+_pattern_to_elements = functools.lru_cache(maxsize=1 << 16)(
+    _signature_to_elements)
+
+
+@dataclasses.dataclass(slots=True)
 class Node:
     """A node in the signature trie."""
 
     # The type of the node.
     #
-    # Leaf nodes are of type "member".
     # Interior nodes can be either "package", or "class".
     type: str
 
@@ -39,43 +163,45 @@ class Node:
     def values(self, selector):
         """Get the values from a set of selected nodes.
 
-        :param selector: a function that can be applied to a key in the nodes
-            attribute to determine whether to return its values.
+        :param selector: a function that can be applied to the key of a child
+            to determine whether to return its values.
 
-        :return: A list of iterables of all the values associated with
-            this node and its children.
+        :return: A list of all the values associated with this node and its
+            children.
         """
-        values = []
-        self.append_values(values, selector)
-        return values
+        return list(self.iter_values(selector))
+
+    def iter_values(self, selector):
+        """Iterate over the values associated with this node and its children.
 
-    def append_values(self, values, selector):
-        """Append the values associated with this node and its children.
+        For each child (key, child) the child node's values are yielded if and
+        only if the selector returns True when called on its key. A child node's
+        values are all the values associated with it and all its descendant
+        nodes.
 
-        For each item (key, child) in nodes the child node's values are returned
-        if and only if the selector returns True when called on its key. A child
-        node's values are all the values associated with it and all its
-        descendant nodes.
+        The order in which the values are yielded is not part of the contract;
+        callers treat the values as a set.
 
-        :param selector: a function that can be applied to a key in the nodes
-        attribute to determine whether to return its values.
-        :param values: a list of a iterables of values.
+        :param selector: a function that can be applied to the key of a child
+        to determine whether to return its values.
+        :return: an iterator over the values.
         """
         raise NotImplementedError("Please Implement this method")
 
     def child_nodes(self):
-        """Get an iterable of the child nodes of this node."""
+        """Get an iterable of the package and class child nodes of this node."""
         raise NotImplementedError("Please Implement this method")
 
 
 # pylint: disable=line-too-long
-@dataclasses.dataclass()
+@dataclasses.dataclass(slots=True)
 class InteriorNode(Node):
     """An interior node in a trie.
 
-    Each interior node has a dict that maps from an element of a signature to
-    either another interior node or a leaf. Each interior node represents either
-    a package, class or nested class. Class members are represented by a Leaf.
+    Each interior node has dicts that map from an element of a signature to
+    either another interior node or a value. Each interior node represents
+    either a package, class or nested class. Class members map directly to the
+    value associated with them.
 
     Associating the set of flags [public-api] with the signature
     "Ljava/lang/Object;->String()Ljava/lang/String;" will cause the following
@@ -84,7 +210,7 @@ class InteriorNode(Node):
     ^- package:java -> Node()
        ^- package:lang -> Node()
            ^- class:Object -> Node()
-              ^- member:String()Ljava/lang/String; -> Leaf([public-api])
+              ^- member:String()Ljava/lang/String; -> [public-api]
 
     Associating the set of flags [blocked,core-platform-api] with the signature
     "Ljava/lang/Character$UnicodeScript;->of(I)Ljava/lang/Character$UnicodeScript;"
@@ -95,88 +221,69 @@ class InteriorNode(Node):
            ^- class:Character -> Node()
               ^- class:UnicodeScript -> Node()
                  ^- member:of(I)Ljava/lang/Character$UnicodeScript;
-                    -> Leaf([blocked,core-platform-api])
+                    -> [blocked,core-platform-api]
     """
 
     # pylint: enable=line-too-long
 
-    # A dict from an element of the signature to the Node/Leaf containing the
-    # next element/value.
-    nodes: typing.Dict[str, Node] = dataclasses.field(default_factory=dict)
+    # A dict from a package element of the signature to the InteriorNode
+    # containing the next element.
+    #
+    # Packages are kept separate from classes and members so that a "*"
+    # wildcard can iterate over the contents of a package without having to
+    # skip its sub-packages.
+    packages: typing.Dict[tuple, "InteriorNode"] = dataclasses.field(
+        default_factory=dict)
+
+    # A dict from a class or member element of the signature to the
+    # InteriorNode containing the next element or, if the element is a member,
+    # to the value associated with the member.
+    #
+    # The value is returned as is from get_matching_rows(), i.e. it is not
+    # wrapped in a collection, so it can be any object, e.g. a csv row.
+    classes_and_members: typing.Dict[tuple, typing.Any] = dataclasses.field(
+        default_factory=dict)
+
+    # A dict from a tuple of elements to the descendant InteriorNode that they
+    # select.
+    #
+    # This allows add() and get_matching_rows() to jump straight to the
+    # deepest node instead of probing the dicts of every package and
+    # class along the way. A node's children are never removed so an entry can
+    # never become stale. It is created by the first call to add() so is only
+    # present on nodes, typically the root, to which signatures are added.
+    path_index: typing.Optional[typing.Dict[tuple, "InteriorNode"]] = \
+        dataclasses.field(default=None, repr=False, compare=False)
+
+    # The cached results of the package wildcard queries made on this node.
+    #
+    # This is a tuple of the generation at which the results were cached and a
+    # dict from the elements of the pattern to a tuple of the matching values.
+    # Keying on the elements rather than the pattern string means that
+    # equivalent patterns, e.g. "Ljava/*" and "java/*", share an entry. The
+    # results are discarded if the generation has changed since they were
+    # cached.
+    #
+    # Each result keeps a tuple referencing every matching value alive for as
+    # long as the node, so to stop memory growing with the number of distinct
+    # queries, e.g. when verify_overlaps.py queries many patterns that are
+    # rarely repeated on the same root, at most _MAX_CACHED_QUERIES results are
+    # kept per node, evicting the least recently used.
+    query_cache: typing.Optional[typing.Tuple[int, typing.Dict[
+        tuple, tuple]]] = dataclasses.field(
+            default=None, repr=False, compare=False)
+
+    # Incremented whenever a value is added to any trie, invalidating all the
+    # cached query results.
+    generation: typing.ClassVar[int] = 0
 
-    # pylint: disable=line-too-long
     @staticmethod
     def signature_to_elements(signature):
-        """Split a signature or a prefix into a number of elements:
-
-        1. The packages (excluding the leading L preceding the first package).
-        2. The class names, from outermost to innermost.
-        3. The member signature.
-        e.g.
-        Ljava/lang/Character$UnicodeScript;->of(I)Ljava/lang/Character$UnicodeScript;
-        will be broken down into these elements:
-        1. package:java
-        2. package:lang
-        3. class:Character
-        4. class:UnicodeScript
-        5. member:of(I)Ljava/lang/Character$UnicodeScript;
-        """
-        # Remove the leading L.
-        #  - java/lang/Character$UnicodeScript;->of(I)Ljava/lang/Character$UnicodeScript;
-        text = signature.removeprefix("L")
-        # Split the signature between qualified class name and the class member
-        # signature.
-        #  0 - java/lang/Character$UnicodeScript
-        #  1 - of(I)Ljava/lang/Character$UnicodeScript;
-        parts = text.split(";->")
-        # If there is no member then this will be an empty list.
-        member = parts[1:]
-        # Split the qualified class name into packages, and class name.
-        #  0 - java
-        #  1 - lang
-        #  2 - Character$UnicodeScript
-        elements = parts[0].split("/")
-        last_element = elements[-1]
-        wildcard = []
-        classes = []
-        if "*" in last_element:
-            if last_element not in ("*", "**"):
-                raise Exception(f"Invalid signature '{signature}': invalid "
-                                f"wildcard '{last_element}'")
-            packages = elements[0:-1]
-            # Cannot specify a wildcard and target a specific member
-            if member:
-                raise Exception(f"Invalid signature '{signature}': contains "
-                                f"wildcard '{last_element}' and "
-                                f"member signature '{member[0]}'")
-            wildcard = [last_element]
-        else:
-            packages = elements[0:-1]
-            # Split the class name into outer / inner classes
-            #  0 - Character
-            #  1 - UnicodeScript
-            classes = last_element.removesuffix(";").split("$")
-
-        # Assemble the parts into a single list, adding prefixes to identify
-        # the different parts. If a wildcard is provided then it looks something
-        # like this:
-        #  0 - package:java
-        #  1 - package:lang
-        #  2 - *
-        #
-        # Otherwise, it looks something like this:
-        #  0 - package:java
-        #  1 - package:lang
-        #  2 - class:Character
-        #  3 - class:UnicodeScript
-        #  4 - member:of(I)Ljava/lang/Character$UnicodeScript;
-        return list(
-            chain([("package", x) for x in packages],
-                  [("class", x) for x in classes],
-                  [("member", x) for x in member],
-                  [("wildcard", x) for x in wildcard]))
+        """Split a signature or a prefix into a tuple of elements.
 
-    # pylint: enable=line-too-long
+        See _signature_to_elements() for details.
+        """
+        return _signature_to_elements(signature)
 
     @staticmethod
     def split_element(element):
@@ -207,16 +314,16 @@ class InteriorNode(Node):
         for element in elements:
             element_type, element_value = InteriorNode.split_element(element)
             separator = ""
-            if element_type == "package":
+            if element_type == TAG_PACKAGE:
                 separator = "/"
-            elif element_type == "class":
-                if preceding_type == "class":
+            elif element_type == TAG_CLASS:
+                if preceding_type == TAG_CLASS:
                     separator = "$"
                 else:
                     separator = "/"
-            elif element_type == "wildcard":
+            elif element_type == TAG_WILDCARD:
                 separator = "/"
-            elif element_type == "member":
+            elif element_type == TAG_MEMBER:
                 separator += ";->"
 
             if signature:
@@ -239,103 +346,188 @@ class InteriorNode(Node):
         """
         # Split the signature into elements.
         elements = self.signature_to_elements(signature)
+        class_elements = elements[:-1]
         # Find the Node associated with the deepest class.
-        node = self
-        for index, element in enumerate(elements[:-1]):
-            if element in node.nodes:
-                node = node.nodes[element]
-            elif only_if_matches and index == 0:
-                return
-            else:
-                selector = self.elements_to_selector(elements[0:index + 1])
-                next_node = InteriorNode(
-                    type=InteriorNode.element_type(element), selector=selector)
-                node.nodes[element] = next_node
-                node = next_node
-        # Add a Leaf containing the value and associate it with the member
-        # signature within the class.
+        if self.path_index is None:
+            self.path_index = {}
+        node = self.path_index.get(class_elements)
+        if node is None:
+            node = self
+            for index, element in enumerate(class_elements):
+                children = node._children(element)
+                if element in children:
+                    node = children[element]
+                elif only_if_matches and index == 0:
+                    return
+                else:
+                    selector = self.elements_to_selector(elements[0:index + 1])
+                    next_node = InteriorNode(
+                        type=element[0], selector=selector)
+                    children[element] = next_node
+                    node = next_node
+            self.path_index[class_elements] = node
+        # Add the value and associate it with the member signature within the
+        # class.
         last_element = elements[-1]
-        last_element_type = self.element_type(last_element)
-        if last_element_type != "member":
+        if last_element[0] != TAG_MEMBER:
             raise Exception(
                 f"Invalid signature: {signature}, does not identify a "
                 "specific member")
-        if last_element in node.nodes:
+        members = node.classes_and_members
+        if last_element in members:
             raise Exception(f"Duplicate signature: {signature}")
-        leaf = Leaf(
-            type=last_element_type,
-            selector=signature,
-            value=value,
-        )
-        node.nodes[last_element] = leaf
+        members[last_element] = value
+        InteriorNode.generation += 1
 
     def get_matching_rows(self, pattern):
         """Get the values (plural) associated with the pattern.
 
-        e.g. If the pattern is a full signature then this will return a list
+        e.g. If the pattern is a full signature then this will return a tuple
         containing the value associated with that signature.
 
-        If the pattern is a class then this will return a list containing the
+        If the pattern is a class then this will return a tuple containing the
         values associated with all members of that class.
 
         If the pattern ends with "*" then the preceding part is treated as a
-        package and this will return a list containing the values associated
+        package and this will return a tuple containing the values associated
         with all the members of all the classes in that package.
 
         If the pattern ends with "**" then the preceding part is treated
-        as a package and this will return a list containing the values
+        as a package and this will return a tuple containing the values
         associated with all the members of all the classes in that package and
         all sub-packages.
 
         :param pattern: the pattern which could be a complete signature or a
         class, or package wildcard.
-        :return: an iterable containing all the values associated with the
-        pattern.
+        :return: a tuple containing all the values associated with the pattern,
+        empty if there are none.
         """
-        elements = self.signature_to_elements(pattern)
-        node = self
-
-        # Include all values from this node and all its children.
-        selector = lambda x: True
-
+        if ";->" in pattern:
+            elements = _signature_to_elements(pattern)
+        else:
+            elements = _pattern_to_elements(pattern)
         last_element = elements[-1]
-        last_element_type, last_element_value = self.split_element(last_element)
-        if last_element_type == "wildcard":
-            elements = elements[:-1]
+        if last_element[0] == TAG_MEMBER:
+            # A complete signature matches at most one value so just look it
+            # up in the node of its class.
+            node = self._find_node(elements[:-1])
+            if node is None or last_element not in node.classes_and_members:
+                return ()
+            return (node.classes_and_members[last_element],)
+        if last_element[0] != TAG_WILDCARD:
+            return tuple(self._iter_matching_rows(elements))
+
+        # The same package wildcards are often queried repeatedly and can
+        # match a large number of values so cache the results.
+        cache = self.query_cache
+        if cache is None or cache[0] != InteriorNode.generation:
+            cache = (InteriorNode.generation, {})
+            self.query_cache = cache
+        queries = cache[1]
+        # Remove and re-insert any cached result so that the dict is kept in
+        # least to most recently used order.
+        rows = queries.pop(elements, None)
+        if rows is None:
+            rows = tuple(self._iter_matching_rows(elements))
+            if len(queries) >= _MAX_CACHED_QUERIES:
+                del queries[next(iter(queries))]
+        queries[elements] = rows
+        return rows
+
+    def _iter_matching_rows(self, elements):
+        """Get an iterable of the values matching the pattern's elements."""
+        last_element_type, last_element_value = elements[-1]
+        if last_element_type == TAG_WILDCARD:
+            node = self._find_node(elements[:-1])
+            if node is None:
+                return ()
             if last_element_value == "*":
                 # Do not include values from sub-packages.
-                selector = lambda x: InteriorNode.element_type(x) != "package"
+                return node._iter_all(include_packages=False)
+            return node._iter_all()
 
-        for element in elements:
-            if element in node.nodes:
-                node = node.nodes[element]
-            else:
-                return []
+        node = self._find_node(elements)
+        if node is None:
+            return ()
 
-        return node.values(selector)
+        # Include all values from this node and all its children.
+        return node._iter_all()
+
+    def _find_node(self, elements):
+        """Find the InteriorNode selected by the elements, or None if none."""
+        if not elements:
+            return self
+        index = self.path_index
+        if index is not None:
+            node = index.get(elements)
+            if node is not None:
+                return node
+        node = self
+        for element in elements:
+            node = node._children(element).get(element)
+            if node is None:
+                return None
+        if index is not None:
+            index[elements] = node
+        return node
+
+    def _children(self, element):
+        """Get the dict of children that would contain the element."""
+        if element[0] == TAG_PACKAGE:
+            return self.packages
+        return self.classes_and_members
+
+    def _items(self):
+        """Get an iterable of the (element, child) pairs of this node.
+
+        The packages come before the classes and members.
+        """
+        if self.packages:
+            return chain(self.packages.items(),
+                         self.classes_and_members.items())
+        return self.classes_and_members.items()
 
-    def append_values(self, values, selector):
-        for key, node in self.nodes.items():
+    def iter_values(self, selector):
+        for key, node in self._items():
             if selector(key):
-                node.append_values(values, lambda x: True)
-
-    def child_nodes(self):
-        return self.nodes.values()
-
+                if key[0] == TAG_MEMBER:
+                    yield node
+                else:
+                    yield from node._iter_all()
 
-@dataclasses.dataclass()
-class Leaf(Node):
-    """A leaf of the trie"""
+    def _iter_all(self, include_packages=True):
+        """Iterate over all the values associated with this node's subtree.
 
-    # The value associated with this leaf.
-    value: typing.Any
+        This uses an explicit stack of iterators over each node's children
+        rather than recursion so that deeply nested packages do not require a
+        Python frame per level. The values of each node's sub-packages are
+        yielded before those of its classes.
 
-    def append_values(self, values, selector):
-        values.append(self.value)
+        :param include_packages: if False then the values from this node's
+        sub-packages are not included.
+        """
+        if include_packages:
+            items = self._items()
+        else:
+            items = self.classes_and_members.items()
+        stack = [iter(items)]
+        while stack:
+            for key, node in stack[-1]:
+                if key[0] == TAG_MEMBER:
+                    yield node
+                else:
+                    stack.append(iter(node._items()))
+                    break
+            else:
+                stack.pop()
 
     def child_nodes(self):
-        return []
+        return list(self.packages.values()) + [
+            node for key, node in self.classes_and_members.items()
+            if key[0] != TAG_MEMBER
+        ]
 
 
 def signature_trie():
     return InteriorNode(type="root", selector="")
+
@@ -32,101 +32,125 @@ class TestSignatureToElements(unittest.TestCase):
         return InteriorNode.elements_to_selector(elements)
 
     def test_nested_inner_classes(self):
-        elements = [
+        elements = (
             ("package", "java"),
             ("package", "lang"),
             ("class", "ProcessBuilder"),
             ("class", "Redirect"),
             ("class", "1"),
             ("member", "<init>()V"),
-        ]
+        )
         signature = "Ljava/lang/ProcessBuilder$Redirect$1;-><init>()V"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, "L" + self.elements_to_signature(elements))
 
     def test_basic_member(self):
-        elements = [
+        elements = (
             ("package", "java"),
             ("package", "lang"),
             ("class", "Object"),
             ("member", "hashCode()I"),
-        ]
+        )
         signature = "Ljava/lang/Object;->hashCode()I"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, "L" + self.elements_to_signature(elements))
 
     def test_double_dollar_class(self):
-        elements = [
+        elements = (
             ("package", "java"),
             ("package", "lang"),
             ("class", "CharSequence"),
             ("class", ""),
             ("class", "ExternalSyntheticLambda0"),
             ("member", "<init>(Ljava/lang/CharSequence;)V"),
-        ]
+        )
         signature = "Ljava/lang/CharSequence$$ExternalSyntheticLambda0;" \
                     "-><init>(Ljava/lang/CharSequence;)V"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, "L" + self.elements_to_signature(elements))
 
     def test_no_member(self):
-        elements = [
+        elements = (
             ("package", "java"),
             ("package", "lang"),
             ("class", "CharSequence"),
             ("class", ""),
             ("class", "ExternalSyntheticLambda0"),
-        ]
+        )
         signature = "Ljava/lang/CharSequence$$ExternalSyntheticLambda0"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, "L" + self.elements_to_signature(elements))
 
     def test_wildcard(self):
-        elements = [
+        elements = (
             ("package", "java"),
             ("package", "lang"),
             ("wildcard", "*"),
-        ]
+        )
         signature = "java/lang/*"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, self.elements_to_signature(elements))
 
     def test_recursive_wildcard(self):
-        elements = [
+        elements = (
             ("package", "java"),
             ("package", "lang"),
             ("wildcard", "**"),
-        ]
+        )
         signature = "java/lang/**"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, self.elements_to_signature(elements))
 
     def test_no_packages_wildcard(self):
-        elements = [
+        elements = (
             ("wildcard", "*"),
-        ]
+        )
         signature = "*"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, self.elements_to_signature(elements))
 
     def test_no_packages_recursive_wildcard(self):
-        elements = [
+        elements = (
             ("wildcard", "**"),
-        ]
+        )
         signature = "**"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, self.elements_to_signature(elements))
 
+    def test_empty_package_wildcard(self):
+        elements = (
+            ("package", ""),
+            ("wildcard", "*"),
+        )
+        self.assertEqual(elements, self.signature_to_elements("/*"))
+
+    def test_empty_package_recursive_wildcard(self):
+        elements = (
+            ("package", ""),
+            ("wildcard", "**"),
+        )
+        self.assertEqual(elements, self.signature_to_elements("L/**"))
+
     def test_non_standard_class_name(self):
-        elements = [
+        elements = (
             ("package", "javax"),
             ("package", "crypto"),
             ("class", "extObjectInputStream"),
-        ]
+        )
         signature = "Ljavax/crypto/extObjectInputStream"
         self.assertEqual(elements, self.signature_to_elements(signature))
         self.assertEqual(signature, "L" + self.elements_to_signature(elements))
 
+    def test_member_containing_arrow(self):
+        # Everything after the first ";->" is the member signature.
+        elements = (
+            ("class", "a"),
+            ("member", "b;->c"),
+        )
+        signature = "La;->b;->c"
+        self.assertEqual(elements, self.signature_to_elements(signature))
+        self.assertEqual(signature, "L" + self.elements_to_signature(elements))
+
     def test_invalid_pattern_wildcard(self):
         pattern = "Ljava/lang/Class*"
         with self.assertRaises(Exception) as context:
@@ -162,6 +186,8 @@ class TestValues(unittest.TestCase):
         self.assertEqual("a/b/C", class_c_node.selector)
 
         self.assertEqual([1, "A", {}], class_c_node.values(lambda _: True))
+        self.assertEqual(
+            ["a/b/C$D"], [n.selector for n in class_c_node.child_nodes()])
 
 class TestGetMatchingRows(unittest.TestCase):
     extractInput = """
@@ -190,10 +216,27 @@ Ljava/util/zip/ZipFile;-><clinit>()V
         actual.sort()
         self.assertEqual(expected, actual)
 
+    def test_result_is_tuple(self):
+        trie = self.read_trie()
+        for pattern in [
+                "java/util/zip/ZipFile;-><clinit>()V",
+                "java/util/zip/ZipFile;->close()V",
+                "java/lang/Object",
+                "java/lang/Missing",
+                "java/lang/*",
+                "java/**",
+                "javax/**",
+        ]:
+            self.assertIsInstance(trie.get_matching_rows(pattern), tuple)
+
     def test_member_pattern(self):
         self.check_patterns("java/util/zip/ZipFile;-><clinit>()V",
                             ["Ljava/util/zip/ZipFile;-><clinit>()V"])
 
+    def test_missing_member_pattern(self):
+        self.check_patterns("java/util/zip/ZipFile;->close()V", [])
+        self.check_patterns("java/util/jar/JarFile;-><clinit>()V", [])
+
     def test_class_pattern(self):
         self.check_patterns("java/lang/Object", [
             "Ljava/lang/Object;->hashCode()I",
@@ -226,6 +269,10 @@ Ljava/util/zip/ZipFile;-><clinit>()V
             "Ljava/util/zip/ZipFile;-><clinit>()V",
         ])
 
+    def test_empty_package_wildcard(self):
+        self.check_patterns("/*", [])
+        self.check_patterns("L/**", [])
+
     def test_node_wildcard(self):
         trie = self.read_trie()
         node = list(trie.child_nodes())[0]
@@ -240,6 +287,34 @@ Ljava/util/zip/ZipFile;-><clinit>()V
 
     # pylint: enable=line-too-long
 
+    def test_pattern_added_after_lookup(self):
+        trie = self.read_trie()
+        self.check_node_patterns(trie, "java/text/*", [])
+        trie.add("Ljava/text/Format;->format()V", "format")
+        self.check_node_patterns(trie, "java/text/*", ["format"])
+        self.check_node_patterns(trie, "java/text/Format", ["format"])
+
+    def test_wildcard_cache_is_bounded(self):
+        trie = self.read_trie()
+        for i in range(100):
+            trie.get_matching_rows(f"p{i}/*")
+            self.check_node_patterns(trie, "java/util/**", [
+                "Ljava/util/zip/ZipFile;-><clinit>()V",
+            ])
+        self.assertLessEqual(len(trie.query_cache[1]), 16)
+
+    def test_wildcard_cache_invalidated_by_add(self):
+        trie = self.read_trie()
+        node = list(trie.child_nodes())[0]
+        self.check_node_patterns(node, "util/**", [
+            "Ljava/util/zip/ZipFile;-><clinit>()V",
+        ])
+        trie.add("Ljava/util/List;->size()I", "Ljava/util/List;->size()I")
+        self.check_node_patterns(node, "util/**", [
+            "Ljava/util/List;->size()I",
+            "Ljava/util/zip/ZipFile;-><clinit>()V",
+        ])
+
 
 if __name__ == "__main__":
     unittest.main(verbosity=2)